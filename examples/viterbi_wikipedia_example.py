@@ -41,11 +41,9 @@ def main():
 
     y = emi[obs_seq]
     tf_s_graph, tf_scores_graph = tf_model.viterbi_decode(y, len(y))
-    tf_s = tf.Session().run(tf_s_graph)
+    tf_s, tf_scores = tf.Session().run([tf_s_graph, tf_scores_graph])
     print("Most likely States: ", [obs[s] for s in tf_s])
 
-    tf_scores = [tf_scores_graph[0]]
-    tf_scores.extend([tf.Session().run(g) for g in tf_scores_graph[1:]])
     pathScores = np.array(np.exp(tf_scores))
     dptable(pathScores, pathScores, states)
 
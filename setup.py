@@ -11,8 +11,11 @@ setup(
     author_email='zdwiel@gmail.com',
     license='Apache',
     packages=['tensorflow_hmm'],
+    python_requires='>=3.6',
     install_requires=[
+        'numba>=0.49',
         'numpy',
         'pytest',
+        'scipy',
     ],
 )
@@ -1,6 +1,9 @@
 import tensorflow as tf
 import numpy as np
 
+from numba import config, get_num_threads, njit, prange, set_num_threads
+from scipy.special import logsumexp
+
 
 class HMM(object):
     """
@@ -11,24 +14,303 @@ class HMM(object):
     - P :: the K by K transition matrix (from state i to state j,
         (i, j) in [1..K])
     - p0 :: the initial distribution (defaults to starting in state 0)
+    - dtype :: the floating point type the parameters are stored in
+        (defaults to np.float64).  np.float32 halves the memory moved by
+        viterbi decoding, where only the argmax matters.  The per step
+        normalization of the tensorflow forward_backward loses precision in
+        float32; HMMNumpy.forward_backward always accumulates in float64 and
+        forward_backward_log is safe in either.
     """
 
-    def __init__(self, P, p0=None):
+    def __init__(self, P, p0=None, dtype=np.float64):
         self.K = P.shape[0]
+        self.dtype = dtype
 
-        self.P = P
-        self.logP = np.log(self.P)
+        self.P = np.ascontiguousarray(P, dtype=dtype)
+        # column major so that reducing over the source states i for a
+        # fixed destination state j walks contiguous memory
+        self.logP = np.asfortranarray(np.log(self.P), dtype=dtype)
 
         if p0 is None:
-            self.p0 = np.ones(self.K)
+            self.p0 = np.ones(self.K, dtype=dtype)
             self.p0 /= sum(self.p0)
         elif len(p0) != self.K:
             raise ValueError(
                 'dimensions of p0 {} must match P[0] {}'.format(
                     p0.shape, P.shape[0]))
         else:
-            self.p0 = p0
-        self.logp0 = np.log(self.p0)
+            self.p0 = np.asarray(p0, dtype=dtype)
+        self.logp0 = np.ascontiguousarray(np.log(self.p0), dtype=dtype)
+
+
+# the parallel kernel forks and joins the worker threads once per timestep,
+# so only parallelize once a step is big enough that this overhead is small
+# next to the work being split.
+_PARALLEL_MIN_K = 128
+
+
+@njit(cache=True)
+def _viterbi_best(prev, logP, j):
+    """
+    best transition into state j given the previous scores prev.  strict >
+    keeps the first maximum, matching np.argmax
+    """
+    best = -np.inf
+    arg = 0
+    for i in range(prev.shape[0]):
+        v = prev[i] + logP[i, j]
+        if v > best:
+            best = v
+            arg = i
+    return best, arg
+
+
+@njit(cache=True)
+def _viterbi_backtrack(pathStates, pathScores):
+    """
+    backtrack the most likely state at each timestep from the viterbi
+    pathStates and pathScores
+    """
+    nT, K = pathScores.shape
+
+    s = np.empty(nT, dtype=np.int64)
+    s[nT - 1] = 0
+    best = pathScores[nT - 1, 0]
+    for j in range(1, K):
+        if pathScores[nT - 1, j] > best:
+            best = pathScores[nT - 1, j]
+            s[nT - 1] = j
+
+    for t in range(nT - 1, 0, -1):
+        s[t - 1] = pathStates[t, s[t]]
+
+    return s
+
+
+@njit(cache=True)
+def _viterbi_nb(logy, logP, logp0):
+    """
+    viterbi decode of log state likelihoods logy of shape (T, K).  returns
+    (s, pathScores) where s is the most likely state at each timestep and
+    pathScores has shape (T, K).
+    """
+    nT, K = logy.shape
+
+    pathStates = np.zeros((nT, K), dtype=np.int64)
+    pathScores = np.empty((nT, K), dtype=logy.dtype)
+
+    if nT == 0:
+        return np.empty(0, dtype=np.int64), pathScores
+
+    # initialize
+    for j in range(K):
+        pathScores[0, j] = logp0[j] + logy[0, j]
+
+    for t in range(1, nT):
+        for j in range(K):
+            best, arg = _viterbi_best(pathScores[t - 1], logP, j)
+            pathScores[t, j] = best + logy[t, j]
+            pathStates[t, j] = arg
+
+    return _viterbi_backtrack(pathStates, pathScores), pathScores
+
+
+@njit(cache=True)
+def _viterbi_nb_k2(logy, logP, logp0):
+    """
+    same as _viterbi_nb, specialized for K == 2.  the argmax over the two
+    source states is a single comparison the compiler can make branchless.
+    """
+    nT = logy.shape[0]
+
+    pathStates = np.zeros((nT, 2), dtype=np.int64)
+    pathScores = np.empty((nT, 2), dtype=logy.dtype)
+
+    if nT == 0:
+        return np.empty(0, dtype=np.int64), pathScores
+
+    # initialize
+    pathScores[0, 0] = logp0[0] + logy[0, 0]
+    pathScores[0, 1] = logp0[1] + logy[0, 1]
+
+    for t in range(1, nT):
+        prev0 = pathScores[t - 1, 0]
+        prev1 = pathScores[t - 1, 1]
+        for j in range(2):
+            a = prev0 + logP[0, j]
+            b = prev1 + logP[1, j]
+            # ties go to state 0, matching np.argmax
+            arg = int(b > a)
+            pathScores[t, j] = (b if arg else a) + logy[t, j]
+            pathStates[t, j] = arg
+
+    return _viterbi_backtrack(pathStates, pathScores), pathScores
+
+
+# up to this many states viterbi_decode uses _viterbi_nb_unrolled
+_UNROLL_MAX_K = 8
+
+
+@njit(cache=True)
+def _viterbi_nb_unrolled(logy, logP, logp0, states):
+    """
+    same as _viterbi_nb, but the states are passed as the tuple
+    (0, 1, ..., K - 1).  the length of a tuple is part of its numba type, so
+    a separate kernel is compiled (and cached on disk) for each K, with
+    constant trip counts the compiler can fully unroll.
+    """
+    nT = logy.shape[0]
+    K = len(states)
+
+    pathStates = np.zeros((nT, K), dtype=np.int64)
+    pathScores = np.empty((nT, K), dtype=logy.dtype)
+
+    if nT == 0:
+        return np.empty(0, dtype=np.int64), pathScores
+
+    # initialize
+    for j in states:
+        pathScores[0, j] = logp0[j] + logy[0, j]
+
+    for t in range(1, nT):
+        prev = pathScores[t - 1]
+        for j in states:
+            # strict > keeps the first maximum, matching np.argmax
+            best = prev[0] + logP[0, j]
+            arg = 0
+            for i in states[1:]:
+                v = prev[i] + logP[i, j]
+                if v > best:
+                    best = v
+                    arg = i
+            pathScores[t, j] = best + logy[t, j]
+            pathStates[t, j] = arg
+
+    return _viterbi_backtrack(pathStates, pathScores), pathScores
+
+
+@njit(parallel=True, cache=True)
+def _viterbi_nb_parallel(logy, logP, logp0):
+    """
+    same as _viterbi_nb, but the destination states of each timestep are
+    split across threads.  the recursion is sequential in t, so only the
+    loop over j is a prange.
+    """
+    nT, K = logy.shape
+
+    pathStates = np.zeros((nT, K), dtype=np.int64)
+    pathScores = np.empty((nT, K), dtype=logy.dtype)
+
+    if nT == 0:
+        return np.empty(0, dtype=np.int64), pathScores
+
+    # initialize
+    for j in range(K):
+        pathScores[0, j] = logp0[j] + logy[0, j]
+
+    for t in range(1, nT):
+        for j in prange(K):
+            best, arg = _viterbi_best(pathScores[t - 1], logP, j)
+            pathScores[t, j] = best + logy[t, j]
+            pathStates[t, j] = arg
+
+    return _viterbi_backtrack(pathStates, pathScores), pathScores
+
+
+def _unrolled_states(K):
+    """
+    the states argument of _viterbi_nb_serial for a model with K states:
+    (0, ..., K - 1) when _viterbi_nb_unrolled should be used, otherwise None
+    """
+    if 2 < K <= _UNROLL_MAX_K:
+        return tuple(range(K))
+    return None
+
+
+@njit(cache=True)
+def _viterbi_nb_serial(logy, logP, logp0, states):
+    """
+    viterbi decode with the fastest serial kernel for the number of states.
+    states comes from _unrolled_states; when it is None numba prunes the
+    unrolled branch at compile time.
+    """
+    if states is not None:
+        return _viterbi_nb_unrolled(logy, logP, logp0, states)
+    if logy.shape[1] == 2:
+        return _viterbi_nb_k2(logy, logP, logp0)
+    return _viterbi_nb(logy, logP, logp0)
+
+
+@njit(parallel=True, cache=True)
+def _viterbi_many_nb(logy, offsets, logP, logp0, states):
+    """
+    viterbi decode of several independent sequences concatenated along the
+    time axis of logy, where sequence n is logy[offsets[n]:offsets[n + 1]].
+    the sequences are split across threads, each decoded with
+    _viterbi_nb_serial.  returns the concatenated (s, pathScores).
+    """
+    s = np.empty(logy.shape[0], dtype=np.int64)
+    pathScores = np.empty(logy.shape, dtype=logy.dtype)
+
+    for n in prange(offsets.shape[0] - 1):
+        start = offsets[n]
+        end = offsets[n + 1]
+        sn, scoresn = _viterbi_nb_serial(
+            logy[start:end], logP, logp0, states
+        )
+        s[start:end] = sn
+        pathScores[start:end] = scoresn
+
+    return s, pathScores
+
+
+@njit(cache=True)
+def _forward_backward_log_nb(logy, logP):
+    """
+    log space forward and backward recursions over log state likelihoods
+    logy of shape (T, K).  returns (forward, backward), both of shape
+    (T + 1, K) and including the uniform initial/final messages.  each
+    logsumexp is shifted by its max so the exps can not overflow.
+    """
+    nT, K = logy.shape
+
+    forward = np.empty((nT + 1, K))
+    backward = np.empty((nT + 1, K))
+    terms = np.empty(K)
+
+    # forward pass
+    forward[0, :] = np.log(1.0 / K)
+    for t in range(nT):
+        for j in range(K):
+            m = -np.inf
+            for i in range(K):
+                terms[i] = forward[t, i] + logP[i, j]
+                m = max(m, terms[i])
+            if m == -np.inf:
+                forward[t + 1, j] = -np.inf
+                continue
+            total = 0.0
+            for i in range(K):
+                total += np.exp(terms[i] - m)
+            forward[t + 1, j] = m + np.log(total) + logy[t, j]
+
+    # backward pass
+    backward[nT, :] = np.log(1.0 / K)
+    for t in range(nT, 0, -1):
+        for i in range(K):
+            m = -np.inf
+            for j in range(K):
+                terms[j] = logP[i, j] + logy[t - 1, j] + backward[t, j]
+                m = max(m, terms[j])
+            if m == -np.inf:
+                backward[t - 1, i] = -np.inf
+                continue
+            total = 0.0
+            for j in range(K):
+                total += np.exp(terms[j] - m)
+            backward[t - 1, i] = m + np.log(total)
+
+    return forward, backward
 
 
 class HMMNumpy(HMM):
@@ -36,7 +318,6 @@ class HMMNumpy(HMM):
     def forward_backward(self, y):
         # set up
         nT = y.shape[0]
-        posterior = np.zeros((nT, self.K))
         forward = np.zeros((nT + 1, self.K))
         backward = np.zeros((nT + 1, self.K))
 
@@ -48,65 +329,184 @@ class HMMNumpy(HMM):
                 y[t]
             )
 
-            forward[t + 1, :] = tmp / np.sum(tmp)
+            np.multiply(tmp, 1.0 / np.sum(tmp), out=forward[t + 1, :])
 
         # backward pass
         backward[-1, :] = 1.0 / self.K
         for t in range(nT, 0, -1):
-            tmp = np.matmul(
-                np.matmul(
-                    self.P, np.diag(y[t - 1])
-                ),
-                backward[t, :].transpose()
-            ).transpose()
+            # scaling the columns of P by y[t - 1] is the same as
+            # P * diag(y[t - 1]) without building the K x K diagonal
+            tmp = np.matmul(self.P * y[t - 1], backward[t, :])
 
-            backward[t - 1, :] = tmp / np.sum(tmp)
+            np.multiply(tmp, 1.0 / np.sum(tmp), out=backward[t - 1, :])
 
         # remove initial/final probabilities
         forward = forward[1:, :]
         backward = backward[:-1, :]
 
         # combine and normalize
-        posterior = np.array(forward) * np.array(backward)
-        # [:,None] expands sum to be correct size
-        posterior = posterior / np.sum(posterior, 1)[:, None]
+        posterior = forward * backward
+        posterior /= np.sum(posterior, axis=1, keepdims=True)
 
         return posterior, forward, backward
 
+    def forward_backward_log(self, y):
+        """
+        runs forward backward algorithm on state probabilities y, carrying
+        the forward and backward messages in log space.  no per step
+        normalization is needed and long sequences can not underflow.
+
+        Arguments
+        ---------
+        y : np.array : shape (T, K) where T is number of timesteps and
+            K is the number of states
+
+        Returns
+        -------
+        (posterior, forward, backward)
+        posterior : np.array : shape (T, K) the posterior probability of
+            each state at each time step
+        forward : np.array : shape (T, K) the unnormalized log forward
+            probability of each state at each time step
+        backward : np.array : shape (T, K) the unnormalized log backward
+            probability of each state at each time step
+        """
+        logy = np.log(np.asarray(y, dtype=np.float64))
+
+        forward, backward = _forward_backward_log_nb(logy, self.logP)
+
+        # remove initial/final probabilities
+        forward = forward[1:, :]
+        backward = backward[:-1, :]
+
+        # combine and normalize
+        posterior = forward + backward
+        posterior -= logsumexp(posterior, axis=1, keepdims=True)
+
+        return np.exp(posterior), forward, backward
+
     def _viterbi_partial_forward(self, scores):
-        tmpMat = np.zeros((self.K, self.K))
-        for i in range(self.K):
-            for j in range(self.K):
-                tmpMat[i, j] = scores[i] + self.logP[i, j]
-        return tmpMat
+        # broadcast scores of shape [K] against logP of shape [K, K] so that
+        # tmpMat[i, j] = scores[i] + logP[i, j]
+        return scores[:, np.newaxis] + self.logP
 
     def viterbi_decode(self, y):
-        y = np.array(y)
+        y = np.asarray(y, dtype=self.dtype)
+        if y.shape[0] == 0:
+            raise ValueError('y must have at least one timestep')
 
-        nT = y.shape[0]
+        logy = np.log(y)
+
+        if self.K >= _PARALLEL_MIN_K and get_num_threads() > 1:
+            return _viterbi_nb_parallel(logy, self.logP, self.logp0)
+
+        return _viterbi_nb_serial(
+            logy, self.logP, self.logp0, _unrolled_states(self.K)
+        )
 
-        pathStates = np.zeros((nT, self.K), dtype=np.int)
-        pathScores = np.zeros((nT, self.K))
+    def viterbi_decode_batch(self, Y):
+        """
+        Runs viterbi decode on a batch of equal length sequences of state
+        probabilities Y.  The recursion is still sequential in time, but each
+        step is done for every sequence in the batch at once.
+
+        Arguments
+        ---------
+        Y : np.array : shape (B, T, K) where B is the number of sequences,
+            T is number of timesteps and K is the number of states
+
+        Returns
+        -------
+        (s, pathScores)
+        s : np.array : shape (B, T) the most likely state of each sequence at
+            each time step.
+        pathScores : np.array : shape (B, T, K) the same as the pathScores
+            returned by viterbi_decode for each sequence
+        """
+        logY = np.log(np.asarray(Y, dtype=self.dtype))
+
+        nB, nT = logY.shape[:2]
+        if nT == 0:
+            raise ValueError('Y must have at least one timestep')
+
+        pathStates = np.zeros((nB, nT, self.K), dtype=np.int64)
+        pathScores = np.zeros((nB, nT, self.K), dtype=self.dtype)
 
         # initialize
-        pathScores[0] = self.logp0 + np.log(y[0])
+        pathScores[:, 0] = self.logp0 + logY[:, 0]
 
-        for t, yy in enumerate(y[1:]):
-            # propagate forward
-            tmpMat = self._viterbi_partial_forward(pathScores[t])
+        for t in range(1, nT):
+            # propagate forward.  tmpMat[b, i, j] = score[b, i] + logP[i, j]
+            tmpMat = pathScores[:, t - 1, :, np.newaxis] + self.logP
 
             # the inferred state
-            pathStates[t + 1] = np.argmax(tmpMat, 0)
-            pathScores[t + 1] = np.max(tmpMat, 0) + np.log(yy)
+            idx = np.argmax(tmpMat, 1)
+            pathStates[:, t] = idx
+            pathScores[:, t] = np.take_along_axis(
+                tmpMat, idx[:, np.newaxis, :], 1
+            )[:, 0] + logY[:, t]
 
         # now backtrack viterbi to find states
-        s = np.zeros(nT, dtype=np.int)
-        s[-1] = np.argmax(pathScores[-1])
+        batch = np.arange(nB)
+        s = np.zeros((nB, nT), dtype=np.int64)
+        s[:, -1] = np.argmax(pathScores[:, -1], 1)
         for t in range(nT - 1, 0, -1):
-            s[t - 1] = pathStates[t, s[t]]
+            s[:, t - 1] = pathStates[batch, t, s[:, t]]
 
         return s, pathScores
 
+    def viterbi_decode_many(self, ys, n_jobs=None):
+        """
+        Runs viterbi decode on each of a list of independent sequences of
+        state probabilities, which may have different lengths.  The
+        sequences are decoded in parallel threads.
+
+        Arguments
+        ---------
+        ys : list of np.array : each of shape (T_n, K) where T_n is number
+            of timesteps in sequence n and K is the number of states
+        n_jobs : int : number of threads to use, at least 1.  defaults to,
+            and is capped at, the number of threads numba is configured with
+            (NUMBA_NUM_THREADS)
+
+        Returns
+        -------
+        (s, pathScores)
+        s : list of np.array : the states returned by viterbi_decode for
+            each sequence
+        pathScores : list of np.array : the pathScores returned by
+            viterbi_decode for each sequence
+        """
+        if n_jobs is not None and n_jobs < 1:
+            raise ValueError(
+                'n_jobs must be at least 1, got {}'.format(n_jobs))
+
+        ys = [np.asarray(y, dtype=self.dtype) for y in ys]
+        if not ys:
+            return [], []
+        if any(y.shape[0] == 0 for y in ys):
+            raise ValueError('every y must have at least one timestep')
+
+        offsets = np.cumsum([0] + [y.shape[0] for y in ys])
+        logy = np.log(np.concatenate(ys))
+
+        if n_jobs is not None:
+            prev_n_jobs = get_num_threads()
+            set_num_threads(min(n_jobs, config.NUMBA_NUM_THREADS))
+        try:
+            s, pathScores = _viterbi_many_nb(
+                logy, offsets, self.logP, self.logp0,
+                _unrolled_states(self.K)
+            )
+        finally:
+            if n_jobs is not None:
+                set_num_threads(prev_n_jobs)
+
+        return (
+            np.split(s, offsets[1:-1]),
+            np.split(pathScores, offsets[1:-1]),
+        )
+
 
 class HMMTensorflow(HMM):
 
@@ -122,63 +522,45 @@ class HMMTensorflow(HMM):
         Returns
         -------
         (posterior, forward, backward)
-        posterior : list of length T of tensorflow graph nodes representing
-            the posterior probability of each state at each time step
-        forward : list of length T of tensorflow graph nodes representing
-            the forward probability of each state at each time step
-        backward : list of length T of tensorflow graph nodes representing
-            the backward probability of each state at each time step
+        posterior : tensorflow tensor of shape (T, K) representing the
+            posterior probability of each state at each time step
+        forward : tensorflow tensor of shape (T, K) representing the
+            forward probability of each state at each time step
+        backward : tensorflow tensor of shape (T, K) representing the
+            backward probability of each state at each time step
         """
-        # set up
-        nT = y.shape[0]
+        # the recursions are expressed with tf.scan so the size of the graph
+        # does not grow with the number of timesteps
+        y = tf.convert_to_tensor(y, dtype=self.dtype)
 
-        posterior = np.zeros((nT, self.K))
-        forward = []
-        backward = np.zeros((nT + 1, self.K))
+        def forward_step(f, yt):
+            tmp = tf.tensordot(f, self.P, 1) * yt
+            return tmp * (1.0 / tf.reduce_sum(tmp))
 
-        # forward pass
-        forward.append(
-            tf.ones((1, self.K), dtype=tf.float64) * (1.0 / self.K)
-        )
-        for t in range(nT):
-            # NOTE: np.matrix expands forward[t, :] into 2d and causes * to be
-            # matrix multiplies instead of element wise that an array would be
-            tmp = tf.mul(
-                tf.matmul(forward[t], self.P),
-                y[t]
-            )
+        def backward_step(b, yt):
+            tmp = tf.tensordot(self.P * yt, b, 1)
+            return tmp * (1.0 / tf.reduce_sum(tmp))
 
-            forward.append(tmp / tf.reduce_sum(tmp))
+        # the initial/final probabilities are only used as the initializers
+        # and are not included in the scan output
+        initial = tf.ones((self.K,), dtype=self.dtype) * (1.0 / self.K)
 
-        # backward pass
-        backward = [None] * (nT + 1)
-        backward[-1] = tf.ones((1, self.K), dtype=tf.float64) * (1.0 / self.K)
-        for t in range(nT, 0, -1):
-            tmp = tf.transpose(
-                tf.matmul(
-                    tf.matmul(self.P, tf.diag(y[t - 1])),
-                    tf.transpose(backward[t])
-                )
-            )
-            backward[t - 1] = tmp / tf.reduce_sum(tmp)
+        # forward pass
+        forward = tf.scan(forward_step, y, initializer=initial)
 
-        # remove initial/final probabilities
-        forward = forward[1:]
-        backward = backward[:-1]
+        # backward pass
+        backward = tf.scan(backward_step, y, initializer=initial, reverse=True)
 
         # combine and normalize
-        posterior = [f * b for f, b in zip(forward, backward)]
-        posterior = [p / tf.reduce_sum(p) for p in posterior]
+        posterior = forward * backward
+        posterior = posterior / tf.expand_dims(tf.reduce_sum(posterior, 1), 1)
 
         return posterior, forward, backward
 
     def _viterbi_partial_forward(self, scores):
-        # first convert scores into shape [K, 1]
-        # then concatenate K of them into shape [K, K]
-        expanded_scores = tf.concat(
-            1, [tf.expand_dims(scores, 1)] * self.K
-        )
-        return expanded_scores + self.logP
+        # convert scores into shape [K, 1] and let broadcasting against logP
+        # of shape [K, K] fill in the rest
+        return tf.expand_dims(scores, 1) + self.logP
 
     def viterbi_decode(self, y, nT):
         """
@@ -188,41 +570,51 @@ class HMMTensorflow(HMM):
         ---------
         y : np.array : shape (T, K) where T is number of timesteps and
             K is the number of states
-        nT : int : number of timesteps in y
+        nT : int : number of timesteps in y.  only kept for backwards
+            compatibility, the number of timesteps is taken from y
 
         Returns
         -------
         (s, pathScores)
-        s : list of length T of tensorflow ints : represents the most likely
-            state at each time step.
-        pathScores : list of length T of tensorflow tensor of length K
+        s : tensorflow tensor of shape (T,) of ints : represents the most
+            likely state at each time step.
+        pathScores : tensorflow tensor of shape (T, K)
             each value at (t, k) is the log likliehood score in state k at
             time t.  sum(pathScores[t, :]) will not necessary == 1
         """
 
-        # pathStates and pathScores wil be of type tf.Tensor.  They
-        # are lists since tensorflow doesn't allow indexing, and the
-        # list and order are only really necessary to build the unrolled
-        # graph.  We never do any computation across all of time at once
-        pathStates = []
-        pathScores = []
+        # take the log of all of y at once rather than one timestep at a time
+        logy = np.log(np.asarray(y, dtype=self.dtype))
 
-        # initialize
-        pathStates.append(None)
-        pathScores.append(self.logp0 + np.log(y[0]))
+        def forward_step(prev, logyt):
+            scores, _ = prev
 
-        for t, yy in enumerate(y[1:]):
             # propagate forward
-            tmpMat = self._viterbi_partial_forward(pathScores[t])
+            tmpMat = self._viterbi_partial_forward(scores)
 
             # the inferred state
-            pathStates.append(tf.argmax(tmpMat, 0))
-            pathScores.append(tf.reduce_max(tmpMat, 0) + np.log(yy))
+            return tf.reduce_max(tmpMat, 0) + logyt, tf.argmax(tmpMat, 0)
+
+        # initialize
+        initial = (
+            tf.constant(self.logp0 + logy[0]),
+            tf.zeros((self.K,), dtype=tf.int64),
+        )
+
+        # pathStates[t] here is the argmax leading into timestep t + 1
+        pathScores, pathStates = tf.scan(
+            forward_step, logy[1:], initializer=initial
+        )
+        pathScores = tf.concat(
+            [tf.expand_dims(initial[0], 0), pathScores], 0
+        )
 
         # now backtrack viterbi to find states
-        s = [0] * nT
-        s[-1] = tf.argmax(pathScores[-1], 0)
-        for t in range(nT - 1, 0, -1):
-            s[t - 1] = tf.gather(pathStates[t], s[t])
+        last = tf.argmax(pathScores[-1], 0)
+        s = tf.scan(
+            lambda st, states: tf.gather(states, st),
+            pathStates, initializer=last, reverse=True
+        )
+        s = tf.concat([s, tf.expand_dims(last, 0)], 0)
 
         return s, pathScores
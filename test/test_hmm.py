@@ -1,10 +1,14 @@
 from __future__ import print_function
 
 import pytest
+import numba
 import numpy as np
 import tensorflow as tf
 
 from tensorflow_hmm import HMMNumpy, HMMTensorflow
+from tensorflow_hmm.hmm import (
+    _viterbi_nb, _viterbi_nb_k2, _viterbi_nb_parallel
+)
 
 
 @pytest.fixture
@@ -35,6 +39,18 @@ def hmm_fair(fair_P):
     return HMMNumpy(fair_P)
 
 
+@pytest.fixture
+def rng(K):
+    return np.random.RandomState(K)
+
+
+@pytest.fixture
+def random_P(rng, K):
+    P = rng.rand(K, K)
+    P /= P.sum(1)[:, None]
+    return P
+
+
 @pytest.fixture
 def hmm_tf_fair(fair_P):
     return HMMTensorflow(fair_P)
@@ -64,7 +80,7 @@ def test_hmm_tf_fair_forward_backward(hmm_tf_fair, hmm_fair):
     np_posterior, _, _ = hmm_fair.forward_backward(y)
     print('tf')
     g_posterior, _, _ = hmm_tf_fair.forward_backward(y)
-    tf_posterior = np.concatenate(tf.Session().run(g_posterior))
+    tf_posterior = tf.Session().run(g_posterior)
 
     print('np_posterior', np_posterior)
     print('tf_posterior', tf_posterior)
@@ -99,6 +115,29 @@ def test_hmm_fair_forward_backward(hmm_fair):
     assert np.isclose(np.sum(posterior, 1), 1).all()
 
 
+def test_hmm_forward_backward_log(hmm_latch, hmm_fair):
+    y = lik(np.array([0, 0.25, 0.5, 0.75, 1]))
+
+    for hmm in [hmm_latch, hmm_fair]:
+        posterior, _, _ = hmm.forward_backward(y)
+        log_posterior, _, _ = hmm.forward_backward_log(y)
+
+        assert np.isclose(posterior, log_posterior).all()
+
+
+def test_hmm_forward_backward_log_long_sequence(hmm_fair):
+    # the unnormalized product of this many likelihoods would underflow.
+    # forward_backward avoids that by normalizing every step, the log space
+    # messages must stay finite without it and give the same posterior
+    y = lik(np.tile([0.001, 0.999], 1000))
+
+    posterior, f, b = hmm_fair.forward_backward_log(y)
+
+    assert np.isfinite(f).all()
+    assert np.isfinite(b).all()
+    assert np.isclose(posterior, hmm_fair.forward_backward(y)[0]).all()
+
+
 def test_hmm_latch_two_step_no_noise(hmm_latch):
     for i in range(2):
         for j in range(2):
@@ -115,6 +154,147 @@ def test_hmm_latch_two_step_no_noise(hmm_latch):
             assert all(states == y)
 
 
+def test_hmm_viterbi_decode_empty(hmm_latch):
+    with pytest.raises(ValueError):
+        hmm_latch.viterbi_decode(np.zeros((0, 2)))
+
+    s, scores = _viterbi_nb_k2(
+        np.zeros((0, 2)), hmm_latch.logP, hmm_latch.logp0
+    )
+    assert s.shape == (0,)
+    assert scores.shape == (0, 2)
+
+
+def test_hmm_viterbi_decode_float32(latch_P, hmm_latch):
+    hmm_latch32 = HMMNumpy(latch_P, dtype=np.float32)
+    y = lik(np.array([0, 0.25, 0.5, 0.75, 1]))
+
+    s, scores = hmm_latch.viterbi_decode(y)
+    s32, scores32 = hmm_latch32.viterbi_decode(y)
+
+    assert scores32.dtype == np.float32
+    assert (s == s32).all()
+    assert np.allclose(scores, scores32)
+
+
+@pytest.mark.parametrize('K', [9, 20, 32, 40])
+def test_hmm_viterbi_kernels(K, rng, random_P):
+    hmm = HMMNumpy(random_P)
+    y = rng.rand(50, K)
+
+    # viterbi_decode_batch is a pure numpy implementation
+    s, scores = hmm.viterbi_decode_batch(y[np.newaxis])
+
+    for viterbi in [_viterbi_nb, _viterbi_nb_parallel]:
+        kernel_s, kernel_scores = viterbi(np.log(y), hmm.logP, hmm.logp0)
+
+        assert (kernel_s == s[0]).all()
+        assert np.allclose(kernel_scores, scores[0])
+
+        # empty sequences return empty results rather than indexing past
+        # the end of the arrays
+        kernel_s, kernel_scores = viterbi(
+            np.zeros((0, K)), hmm.logP, hmm.logp0
+        )
+        assert kernel_s.shape == (0,)
+        assert kernel_scores.shape == (0, K)
+
+
+@pytest.mark.parametrize('K', [1, 3, 4, 5, 6, 7, 8])
+def test_hmm_viterbi_decode_unrolled(K, rng, random_P):
+
+    ys = [
+        rng.rand(50, K),
+        # every state equally likely at every step, so each argmax is a tie
+        np.ones((10, K)),
+        # ties between some of the states, with impossible states mixed in
+        rng.randint(0, 3, (30, K)) / 2.0,
+    ]
+    hmms = [
+        HMMNumpy(random_P),
+        HMMNumpy(np.ones((K, K)) / K),
+    ]
+
+    for hmm in hmms:
+        for y in ys:
+            s, scores = hmm.viterbi_decode(y)
+            # viterbi_decode_batch is a pure numpy implementation
+            batch_s, batch_scores = hmm.viterbi_decode_batch(y[np.newaxis])
+
+            assert (s == batch_s[0]).all()
+            assert np.allclose(scores, batch_scores[0])
+
+
+def test_hmm_viterbi_decode_batch(hmm_latch):
+    ys = [
+        lik(np.array([0, 0, 1, 1])),
+        lik(np.array([0, 0, 0, 0])),
+        lik(np.array([1, 1, 1, 1])),
+        lik(np.array([0, 0.25, 0.75, 1])),
+    ]
+
+    batch_s, batch_scores = hmm_latch.viterbi_decode_batch(np.array(ys))
+
+    for y, bs, bscores in zip(ys, batch_s, batch_scores):
+        s, scores = hmm_latch.viterbi_decode(y)
+
+        assert (bs == s).all()
+        assert np.allclose(bscores, scores)
+
+
+def test_hmm_viterbi_decode_batch_empty(hmm_latch):
+    with pytest.raises(ValueError):
+        hmm_latch.viterbi_decode_batch(np.zeros((3, 0, 2)))
+
+
+def test_hmm_viterbi_decode_many(hmm_latch):
+    ys = [
+        lik(np.array([0, 0, 1, 1])),
+        lik(np.array([1, 1])),
+        lik(np.array([0, 0.25, 0.5, 0.75, 1])),
+    ]
+
+    many_s, many_scores = hmm_latch.viterbi_decode_many(ys)
+
+    assert len(many_s) == len(ys)
+    for y, ms, mscores in zip(ys, many_s, many_scores):
+        s, scores = hmm_latch.viterbi_decode(y)
+
+        assert (ms == s).all()
+        assert np.allclose(mscores, scores)
+
+
+@pytest.mark.parametrize('K', [1, 2, 3, 8, 10])
+@pytest.mark.parametrize('n_jobs', [None, 1, 10000])
+def test_hmm_viterbi_decode_many_random(K, rng, random_P, n_jobs):
+    hmm = HMMNumpy(random_P)
+    ys = [rng.rand(n, K) for n in [1, 7, 30, 2]]
+
+    num_threads = numba.get_num_threads()
+    many_s, many_scores = hmm.viterbi_decode_many(ys, n_jobs=n_jobs)
+
+    # the thread count is restored after the call
+    assert numba.get_num_threads() == num_threads
+    for y, ms, mscores in zip(ys, many_s, many_scores):
+        s, scores = hmm.viterbi_decode(y)
+
+        assert (ms == s).all()
+        assert np.allclose(mscores, scores)
+
+
+def test_hmm_viterbi_decode_many_empty(hmm_latch):
+    assert hmm_latch.viterbi_decode_many([]) == ([], [])
+
+    with pytest.raises(ValueError):
+        hmm_latch.viterbi_decode_many([lik([0, 1, 1]), np.zeros((0, 2))])
+
+
+@pytest.mark.parametrize('n_jobs', [0, -1])
+def test_hmm_viterbi_decode_many_bad_n_jobs(hmm_latch, n_jobs):
+    with pytest.raises(ValueError, match='n_jobs'):
+        hmm_latch.viterbi_decode_many([lik([0, 1, 1])], n_jobs=n_jobs)
+
+
 def test_hmm_tf_partial_forward(hmm_tf_latch, hmm_latch):
     scoress = [
         np.log(np.array([0, 1])),
@@ -132,6 +312,19 @@ def test_hmm_tf_partial_forward(hmm_tf_latch, hmm_latch):
         assert (tf_ret == np_ret).all()
 
 
+def test_hmm_tf_viterbi_decode_new_graph(hmm_tf_latch, hmm_latch):
+    # the model must not be tied to the graph it was constructed in
+    y = lik(np.array([0, 0.25, 0.5, 0.75, 1]))
+
+    with tf.Graph().as_default():
+        tf_s_graph, _ = hmm_tf_latch.viterbi_decode(y, len(y))
+        tf_s = tf.Session().run(tf_s_graph)
+
+    np_s, _ = hmm_latch.viterbi_decode(y)
+
+    assert (tf_s == np_s).all()
+
+
 def test_hmm_tf_viterbi_decode(hmm_tf_latch, hmm_latch):
     ys = [
         lik(np.array([0, 0])),
@@ -144,13 +337,12 @@ def test_hmm_tf_viterbi_decode(hmm_tf_latch, hmm_latch):
         print(y)
 
         tf_s_graph, tf_scores_graph = hmm_tf_latch.viterbi_decode(y, len(y))
-        tf_s = tf.Session().run(tf_s_graph)
-        tf_scores = [tf_scores_graph[0]]
-        tf_scores.extend([tf.Session().run(g) for g in tf_scores_graph[1:]])
-        print(np.array(tf_scores))
+        tf_s, tf_scores = tf.Session().run([tf_s_graph, tf_scores_graph])
+        print(tf_scores)
 
         np_s, np_scores = hmm_latch.viterbi_decode(y)
         print(np_scores)
 
         assert (tf_s == np_s).all()
+        assert np.allclose(tf_scores, np_scores)
         print()